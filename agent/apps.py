@@ -1,7 +1,75 @@
+import asyncio
+import atexit
+import concurrent.futures
+import threading
+
+try:
+    import uvloop
+except ImportError:  # uvloop isn't available on Windows
+    uvloop = None
+
 from django.apps import AppConfig
 
+# Long-lived event loop that owns the FinancialAgent and its connections. Views
+# submit coroutines to it instead of creating a new loop for every request.
+agent_loop: asyncio.AbstractEventLoop | None = None
+
+# Keep-alive pool for the agent's MCP streamable_http servers, shared by every
+# request in the process. Created in ready() and closed at exit.
+mcp_http_client = None
+
+# Keep-alive pool for the OpenAI API, handed to ChatOpenAI
+openai_http_client = None
+
+
+def run_on_agent_loop(coro, timeout: float | None = None):
+    """Run ``coro`` on the agent event loop and block until it finishes."""
+    future = asyncio.run_coroutine_threadsafe(coro, agent_loop)
+    try:
+        return future.result(timeout=timeout)
+    except concurrent.futures.TimeoutError:
+        future.cancel()
+        raise
+
+
+async def arun_on_agent_loop(coro, timeout: float | None = None):
+    """Await ``coro`` on the agent event loop without blocking the caller's loop."""
+    future = asyncio.run_coroutine_threadsafe(coro, agent_loop)
+    # Cancelling the wrapper (e.g. on timeout) also cancels the task on agent_loop
+    return await asyncio.wait_for(asyncio.wrap_future(future), timeout)
+
+
+def _close_http_clients():
+    """Close the shared HTTP connection pools at interpreter exit."""
+    for client in (mcp_http_client, openai_http_client):
+        if client is not None:
+            run_on_agent_loop(client.aclose(), timeout=5)
+
 
 class AgentConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'agent'
     verbose_name = 'Financial Agent'
+
+    def ready(self):
+        global agent_loop, mcp_http_client, openai_http_client
+        if agent_loop is None:
+            import httpx
+            from agent.test_client import create_mcp_http_pool
+
+            # libuv-backed loop for the agent's many short MCP/OpenAI HTTP calls
+            agent_loop = uvloop.new_event_loop() if uvloop else asyncio.new_event_loop()
+            threading.Thread(
+                target=agent_loop.run_forever, name="agent-event-loop", daemon=True
+            ).start()
+
+            mcp_http_client = create_mcp_http_pool(
+                limits=httpx.Limits(max_keepalive_connections=100),
+            )
+            # 600s matches the OpenAI SDK default; reasoning models can take minutes
+            openai_http_client = httpx.AsyncClient(
+                limits=httpx.Limits(max_connections=256, max_keepalive_connections=256),
+                timeout=httpx.Timeout(600.0, connect=5.0),
+            )
+            # Registered before the views' agent shutdown hook, so runs after it
+            atexit.register(_close_http_clients)
@@ -0,0 +1,36 @@
+"""
+Bounded in-memory checkpointer for the financial agent.
+"""
+from collections import OrderedDict
+
+from langgraph.checkpoint.memory import InMemorySaver
+
+
+class BoundedInMemorySaver(InMemorySaver):
+    """
+    InMemorySaver that keeps at most ``max_threads`` conversations in memory,
+    evicting the least recently used thread once the limit is exceeded.
+
+    InMemorySaver's async methods delegate to the sync ones, so overriding
+    ``get_tuple`` and ``put`` covers both code paths.
+    """
+
+    def __init__(self, max_threads: int = 1024, **kwargs):
+        super().__init__(**kwargs)
+        self.max_threads = max_threads
+        self._threads: OrderedDict[str, None] = OrderedDict()
+
+    def get_tuple(self, config):
+        thread_id = config["configurable"]["thread_id"]
+        if thread_id in self._threads:
+            self._threads.move_to_end(thread_id)
+        return super().get_tuple(config)
+
+    def put(self, config, *args, **kwargs):
+        thread_id = config["configurable"]["thread_id"]
+        self._threads[thread_id] = None
+        self._threads.move_to_end(thread_id)
+        while len(self._threads) > self.max_threads:
+            evicted, _ = self._threads.popitem(last=False)
+            self.delete_thread(evicted)
+        return super().put(config, *args, **kwargs)
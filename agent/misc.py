@@ -1,26 +1,10 @@
-from pydantic import BaseModel, Field
-from typing import Optional
-
-
-class FinancialAgentOutput(BaseModel):
-    user_output: str = Field(..., description="Main output from the agent (mandatory)")
-    insights_summary: Optional[str] = Field(
-        None, description="Optional insights summary based on user needs"
-    )
-    charting_url: Optional[str] = Field(
-        None, description="Optional URL pointing to generated charts (as string)"
-    )
-
-    class Config:
-        schema_extra = {
-            "example": {
-                "user_output": "The stock price of TSLA is up 5% today.",
-                "insights_summary": "TSLA is trending due to high EV demand.",
-                "charting_url": "https://charts.example.com/tsla"
-            }
-        }
+from agent.response_validator import AgentResponse
 
 
+# The agent's structured output schema is AgentResponse; this alias keeps the
+# agent-facing name without defining a second Pydantic model. Its validators
+# drop unusable optional values (e.g. a non-URL charting_url) rather than fail.
+FinancialAgentOutput = AgentResponse
 
 
 system_prompt = """
@@ -54,6 +38,28 @@ You are a financial expert AI assistant with access to powerful tools. Answer qu
 """
 
 
+# System instruction for FinancialAgent.invoke_structured's fallback extraction
+# call; the agent's reply follows it as a separate assistant message.
+# Used as a ChatPromptTemplate, so literal braces must be doubled.
+parsing_prompt = """
+Extract the following information from the prior assistant reply and format it according to the schema:
+- user_output (mandatory): The main response to the user
+- insights_summary (optional): Any key insights or analysis
+- charting_url (optional): Any chart URLs that were generated
+"""
+
+
+# Sent to the model as an extra system message during FinancialAgent.invoke_structured
+# runs so the ReAct agent answers in FinancialAgentOutput's shape and no second
+# LLM call is needed. It is never saved to the thread's checkpoint.
+structured_output_prompt = """
+
+Respond with a single JSON object and nothing else, using exactly these keys:
+- "user_output" (string, mandatory): The main response to the user
+- "insights_summary" (string or null): Any key insights or analysis
+- "charting_url" (string or null): Any chart URL that was generated"""
+
+
 test_prompt = '''
 What company owns Tylenol? Search for when Trump made autism statements about it in September 2025. 
 Show me the stock price impact with a chart comparing before and after. Be specific with dates and percentages.
@@ -0,0 +1,24 @@
+"""
+Renderers for the agent API.
+"""
+import orjson
+from rest_framework.renderers import JSONRenderer
+
+
+class ORJSONRenderer(JSONRenderer):
+    """Renderer that encodes responses with orjson instead of the stdlib json module."""
+    charset = None
+
+    # Dict keys in LangChain traces aren't always str, and tool outputs may
+    # carry numpy values from the finance tools
+    options = orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        options = self.options
+        # orjson only supports 2-space indentation; any requested indent enables it
+        if self.get_indent(accepted_media_type, renderer_context or {}):
+            options |= orjson.OPT_INDENT_2
+        # default=str covers lazy translation strings, Decimal and the like
+        return orjson.dumps(data, default=str, option=options)
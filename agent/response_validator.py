@@ -1,6 +1,20 @@
-from pydantic import BaseModel, Field, HttpUrl, validator
-from typing import Optional, Dict, Any
-import json
+import re
+from pydantic import BaseModel, Field, TypeAdapter, validator
+from typing import Optional, Dict, Any, Union
+import orjson
+
+
+_CHARTING_URL_PATTERN = r"^https?://"
+_CHARTING_URL_RE = re.compile(_CHARTING_URL_PATTERN)
+
+
+def normalize_charting_url(value: Any) -> Optional[str]:
+    """Return a stripped http(s) chart URL, or None for anything else"""
+    if isinstance(value, str):
+        value = value.strip()
+        if _CHARTING_URL_RE.match(value):
+            return value
+    return None
 
 
 class AgentResponse(BaseModel):
@@ -24,11 +38,21 @@ class AgentResponse(BaseModel):
         description="Optional summary of key insights, analysis, or findings from the query."
     )
     
-    charting_url: Optional[HttpUrl] = Field(
+    charting_url: Optional[str] = Field(
         None,
+        pattern=_CHARTING_URL_PATTERN,
         description="Optional URL to charts, graphs, or visualizations generated for the user."
     )
     
+    class Config:
+        json_schema_extra = {
+            "example": {
+                "user_output": "The stock price of TSLA is up 5% today.",
+                "insights_summary": "TSLA is trending due to high EV demand.",
+                "charting_url": "https://charts.example.com/tsla"
+            }
+        }
+    
     @validator('user_output')
     def validate_user_output(cls, v):
         """Ensure user_output is not empty or just whitespace"""
@@ -45,6 +69,14 @@ class AgentResponse(BaseModel):
                 return None
         return v
     
+    @validator('charting_url', pre=True)
+    def validate_charting_url(cls, v):
+        """
+        Treat a blank or non-http(s) charting_url (e.g. "N/A" from the LLM) as
+        not provided instead of rejecting the whole response
+        """
+        return normalize_charting_url(v)
+    
     def to_user_friendly_dict(self) -> Dict[str, Any]:
         """Convert to a user-friendly dictionary format"""
         result = {"response": self.user_output}
@@ -53,50 +85,70 @@ class AgentResponse(BaseModel):
             result["insights"] = self.insights_summary
         
         if self.charting_url:
-            result["chart_url"] = str(self.charting_url)
+            result["chart_url"] = self.charting_url
         
         return result
     
-    def to_json_string(self, **kwargs) -> str:
+    def to_json_string(self, indent: bool = True, **kwargs) -> str:
         """Convert to JSON string with pretty formatting by default"""
-        if 'indent' not in kwargs:
-            kwargs['indent'] = 2
-        return self.json(**kwargs)
+        return _ADAPTER.dump_json(self, indent=2 if indent else None, **kwargs).decode()
     
     @classmethod
-    def from_raw_response(cls, raw_response: str) -> 'AgentResponse':
+    def from_raw_response(cls, raw_response: Union[str, bytes]) -> 'AgentResponse':
         """
         Create AgentResponse from raw agent response text.
         Tries to parse as JSON first, falls back to treating as plain text.
         """
-        try:
-            # Try to parse as JSON
-            data = json.loads(raw_response)
-            return cls(**data)
-        except (json.JSONDecodeError, TypeError, ValueError):
-            # If not JSON, treat as plain user_output
-            return cls(user_output=raw_response)
+        # Only a JSON object can hold our fields; most replies are plain text,
+        # so sniff the first character instead of raising JSONDecodeError.
+        # Anything else (e.g. a list of content blocks) is left to validation.
+        if isinstance(raw_response, (str, bytes)) and raw_response.lstrip()[:1] in ("{", b"{"):
+            try:
+                # orjson accepts str and bytes directly
+                data = orjson.loads(raw_response)
+                return cls(**data)
+            except (orjson.JSONDecodeError, TypeError, ValueError):
+                pass
+        # If not JSON, treat as plain user_output
+        return cls(user_output=raw_response)
+    
+    # The create_* builders below are only called with data produced inside the
+    # codebase, so they skip validation via model_construct. External input
+    # goes through from_raw_response, which validates fully.
     
     @classmethod
     def create_simple_response(cls, message: str) -> 'AgentResponse':
         """Create a simple response with just user_output"""
-        return cls(user_output=message)
+        return cls.model_construct(user_output=message)
     
     @classmethod
     def create_with_insights(cls, message: str, insights: str) -> 'AgentResponse':
         """Create a response with user_output and insights"""
-        return cls(user_output=message, insights_summary=insights)
+        return cls.model_construct(user_output=message, insights_summary=insights)
     
     @classmethod
     def create_with_chart(cls, message: str, chart_url: str, insights: Optional[str] = None) -> 'AgentResponse':
         """Create a response with user_output, chart URL, and optional insights"""
-        return cls(
+        return cls.model_construct(
             user_output=message,
             insights_summary=insights,
             charting_url=chart_url
         )
 
 
+# Built once at import so every to_json_string call reuses the compiled
+# pydantic-core serializer
+_ADAPTER = TypeAdapter(AgentResponse)
+
+
+def _message_content(message: Any) -> Any:
+    """Return the content of a LangChain message object or a message dict"""
+    content = getattr(message, "content", None)
+    if content is None and isinstance(message, dict):
+        content = message.get("content")
+    return content
+
+
 class AgentResponseParser:
     """Helper class for parsing and validating agent responses"""
     
@@ -138,15 +190,13 @@ class AgentResponseParser:
         
         # Look for response in common locations
         if isinstance(agent_output, dict):
-            # Check messages array
+            # Check messages array; the last message is almost always the answer,
+            # so only walk further back if it has no content
             messages = agent_output.get("messages", [])
-            for message in reversed(messages):  # Start from the end
-                if hasattr(message, 'content') and message.content:
-                    response_text = message.content
-                    break
-                elif isinstance(message, dict) and message.get('content'):
-                    response_text = message['content']
-                    break
+            response_text = next(
+                (content for content in map(_message_content, reversed(messages)) if content),
+                "",
+            )
             
             # Fallback to direct content
             if not response_text:
@@ -1,41 +1,40 @@
 """
 Serializers for the agent API.
 """
-from rest_framework import serializers
-import json
-
-
-class AgentQuerySerializer(serializers.Serializer):
-    """Serializer for agent query requests."""
-    prompt = serializers.CharField(required=True, help_text="The user's query prompt")
-    thread_id = serializers.CharField(required=False, default="1", help_text="Thread ID for conversation context")
-
-
-class AgentResponseSerializer(serializers.Serializer):
-    """Serializer for agent responses."""
-    response = serializers.CharField(help_text="The agent's response")
-    thread_id = serializers.CharField(help_text="Thread ID used for this query")
-    full_response = serializers.JSONField(required=False, help_text="Full response data from agent")
-    
-    def validate_full_response(self, value):
-        """Allow full_response to be any type - dict, list, or string"""
-        if value is None:
-            return value
-        # If it's already a dict or list, return as is
-        if isinstance(value, (dict, list)):
-            return value
-        # If it's a string, try to parse it as JSON, otherwise return the string
-        if isinstance(value, str):
-            try:
-                return json.loads(value)
-            except json.JSONDecodeError:
-                return {"raw": value}
-        return value
-
-
-class StructuredAgentResponseSerializer(serializers.Serializer):
-    """Serializer for structured agent responses."""
-    user_output = serializers.CharField(help_text="Main response to the user")
-    insights_summary = serializers.CharField(required=False, allow_null=True, help_text="Key insights or analysis")
-    charting_url = serializers.CharField(required=False, allow_null=True, help_text="Chart URL if generated")
-    thread_id = serializers.CharField(help_text="Thread ID used for this query")
+from typing import Annotated
+
+from pydantic import BaseModel, Field, ValidationError
+
+
+class AgentQuery(BaseModel):
+    """Agent query request, validated directly from the raw JSON body."""
+    prompt: str = Field(..., min_length=1, description="The user's query prompt")
+    thread_id: str = Field("1", min_length=1, description="Thread ID for conversation context")
+
+    class Config:
+        str_strip_whitespace = True
+        # Like DRF's CharField, accept numbers (e.g. "thread_id": 5) as strings
+        coerce_numbers_to_str = True
+
+
+class AgentBatchQuery(BaseModel):
+    """Batch of agent query prompts, validated directly from the raw JSON body."""
+    prompts: list[Annotated[str, Field(min_length=1)]] = Field(
+        ..., min_length=1, max_length=20, description="The user's query prompts"
+    )
+    thread_id: str = Field("1", min_length=1, description="Base thread ID; each prompt gets '<thread_id>-<n>'")
+
+    class Config:
+        str_strip_whitespace = True
+        # Like DRF's CharField, accept numbers (e.g. "thread_id": 5) as strings
+        coerce_numbers_to_str = True
+
+
+def format_validation_errors(exc: ValidationError) -> dict:
+    """Format a pydantic ValidationError like DRF's ``serializer.errors``."""
+    errors = {}
+    for error in exc.errors():
+        field = ".".join(str(loc) for loc in error["loc"]) or "non_field_errors"
+        errors.setdefault(field, []).append(error["msg"])
+    return errors
+
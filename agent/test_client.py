@@ -1,17 +1,22 @@
 import os
 import asyncio
 import logging
+from collections import OrderedDict
 from typing import Any
 
-from langchain_openai import ChatOpenAI
-from langchain_mcp_adapters.client import MultiServerMCPClient
-from langchain_core.messages.utils import count_tokens_approximately
-from langgraph.prebuilt import create_react_agent
-from langgraph.checkpoint.memory import InMemorySaver
-from langmem.short_term import SummarizationNode, RunningSummary
-from langgraph.prebuilt.chat_agent_executor import AgentState
+import httpx
+import orjson
 
-from agent.misc import FinancialAgentOutput, test_prompt, system_prompt
+# LangChain/LangGraph modules are imported inside FinancialAgent so that
+# importing this module (e.g. from the Django URLconf) stays cheap.
+from agent.misc import (
+    FinancialAgentOutput,
+    test_prompt,
+    system_prompt,
+    parsing_prompt,
+    structured_output_prompt,
+)
+from agent.response_validator import normalize_charting_url
 
 # Configure logging
 logging.basicConfig(
@@ -20,6 +25,82 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# Constant system message shared by every request. LangChain converts it into
+# a new message object on each call, so the dict itself is never mutated.
+SYSTEM_MSG = {"role": "system", "content": system_prompt}
+
+# Format instruction for invoke_structured runs
+STRUCTURED_OUTPUT_MSG = {"role": "system", "content": structured_output_prompt.strip()}
+
+
+def _agent_prompt(state, config):
+    """
+    Builds the model input for each agent step. Structured runs get the format
+    instruction here instead of in the user message, so it is never
+    checkpointed and later plain turns on the thread don't inherit it.
+    """
+    messages = state["messages"]
+    if config["configurable"].get("structured"):
+        return [*messages, STRUCTURED_OUTPUT_MSG]
+    return messages
+
+
+def _parse_structured_output(text: Any) -> FinancialAgentOutput | None:
+    """Parses the agent's reply locally if it is already FinancialAgentOutput JSON."""
+    if not isinstance(text, str):
+        return None
+    # Models often wrap JSON answers in a markdown code fence
+    text = text.strip().removeprefix("```json").removeprefix("```").removesuffix("```")
+    try:
+        data = orjson.loads(text)
+    except orjson.JSONDecodeError:
+        return None
+    if not isinstance(data, dict):
+        return None
+    user_output = data.get("user_output")
+    insights_summary = data.get("insights_summary")
+    # Anything off-schema is left to the LLM extraction fallback
+    if not isinstance(user_output, str) or not user_output.strip():
+        return None
+    if insights_summary is not None and not isinstance(insights_summary, str):
+        return None
+    # The types are checked above, so skip full validation and apply the same
+    # clean-up the validators do: strip text, blanks and non-URLs become None
+    return FinancialAgentOutput.model_construct(
+        user_output=user_output.strip(),
+        insights_summary=(insights_summary or "").strip() or None,
+        charting_url=normalize_charting_url(data.get("charting_url")),
+    )
+
+
+class SharedAsyncClient(httpx.AsyncClient):
+    """
+    httpx client that outlives the ``async with`` block each MCP session wraps
+    around it, so one connection pool is reused until it is closed explicitly.
+    """
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        pass
+
+
+def create_mcp_http_pool(**kwargs) -> SharedAsyncClient:
+    """
+    Builds a shared connection pool for MCP streamable_http servers with the
+    defaults of MCP's own create_mcp_http_client: redirects are followed (e.g.
+    a 307 from /mcp to /mcp/), 30s requests and 300s SSE reads. HTTP/2 lets
+    concurrent tool calls to an https server multiplex over one connection;
+    plain-http servers stay on HTTP/1.1 keep-alive.
+    """
+    return SharedAsyncClient(
+        http2=True,
+        follow_redirects=True,
+        timeout=httpx.Timeout(30.0, read=300.0),
+        **kwargs,
+    )
+
 
 class FinancialAgent:
     """
@@ -27,6 +108,14 @@ class FinancialAgent:
     (charting, Yahoo Finance, Tavily) and a summarization node for context management.
     """
 
+    # Compiled ReAct graphs shared across instances, keyed by everything baked
+    # into the graph: the model and its HTTP client, the MCP servers and pool
+    # the tools call through, and the summarization limits. Each agent
+    # attaches its own checkpointer to a copy.
+    # Bounded LRU so worker reloads or varying configs can't grow it forever.
+    _AGENT_CACHE: OrderedDict[tuple, Any] = OrderedDict()
+    _AGENT_CACHE_SIZE = 8
+
     def __init__(
         self,
         openai_api_key: str | None = None,
@@ -37,29 +126,61 @@ class FinancialAgent:
         max_summary_tokens: int = 1000,
         enable_yfinance: bool = True,
         enable_tavily: bool = True,
+        max_threads: int = 1024,
+        enable_summarization: bool = False,
+        max_retries: int = 2,
+        mcp_http_client: SharedAsyncClient | None = None,
+        http_async_client: httpx.AsyncClient | None = None,
     ):
+        from langchain_core.prompts import ChatPromptTemplate
+        from langchain_openai import ChatOpenAI
+        from langchain_mcp_adapters.client import MultiServerMCPClient
+        from agent.checkpointer import BoundedInMemorySaver
+
         logger.info("🚀 Initializing FinancialAgent...")
-        logger.info(f"📊 Model: {model_name}")
-        logger.info(f"🔧 Chart URL: {chart_url}")
-        logger.info(f"📈 Yahoo Finance enabled: {enable_yfinance}")
-        logger.info(f"🔍 Tavily enabled: {enable_tavily}")
+        logger.info("📊 Model: %s", model_name)
+        logger.info("🔧 Chart URL: %s", chart_url)
+        logger.info("📈 Yahoo Finance enabled: %s", enable_yfinance)
+        logger.info("🔍 Tavily enabled: %s", enable_tavily)
         
         # === API keys and model setup ===
         self.openai_api_key = openai_api_key or os.getenv("OPENAI_KEY")
         self.tavily_api_key = tavily_api_key or os.getenv("TAVILY_API_KEY")
 
-        self.model = ChatOpenAI(model=model_name, api_key=self.openai_api_key)
+        self.model_name = model_name
+        # http_async_client lets callers share one keep-alive pool for OpenAI
+        # calls; None keeps the SDK's per-instance client
+        self.model = ChatOpenAI(
+            model=model_name,
+            api_key=self.openai_api_key,
+            http_async_client=http_async_client,
+            # The SDK retries rate limits and 5xx with exponential backoff
+            max_retries=max_retries,
+        )
+        # Bind the structured-output schema and extraction prompt once instead
+        # of on every request; only the agent's reply is filled in per call
+        self._structured_model = self.model.with_structured_output(FinancialAgentOutput)
+        self._parse_chain = ChatPromptTemplate.from_messages(
+            [("system", parsing_prompt), ("ai", "{final_message}")]
+        ) | self._structured_model
         logger.info("✅ OpenAI model initialized")
         
         # === MCP Client Setup (only enable what's needed) ===
+        # One keep-alive pool shared by every HTTP MCP server. A pool passed
+        # in by the caller is also closed by the caller.
+        self._owns_mcp_http_client = mcp_http_client is None
+        self._mcp_http_client = mcp_http_client or create_mcp_http_pool(
+            limits=httpx.Limits(max_keepalive_connections=32, max_connections=64),
+        )
         mcp_servers = {}
         
         # Only add chart if URL is provided
         if chart_url:
-            logger.info(f"📊 Adding chart server: {chart_url}")
+            logger.info("📊 Adding chart server: %s", chart_url)
             mcp_servers["chart"] = {
                 "url": chart_url,
                 "transport": "streamable_http",
+                "httpx_client_factory": self._mcp_http_client_factory,
             }
         
         # Optional: Yahoo Finance (requires mcp-yahoo-finance installed)
@@ -77,64 +198,119 @@ class FinancialAgent:
             mcp_servers["tavily"] = {
                 "url": f"https://mcp.tavily.com/mcp/?tavilyApiKey={self.tavily_api_key}",
                 "transport": "streamable_http",
+                "httpx_client_factory": self._mcp_http_client_factory,
             }
         
-        logger.info(f"🔌 Total MCP servers configured: {len(mcp_servers)}")
+        logger.info("🔌 Total MCP servers configured: %d", len(mcp_servers))
         self.client = MultiServerMCPClient(mcp_servers) if mcp_servers else None
 
-        # === Summarization Node for rolling memory ===
-        self.summarization_node = SummarizationNode(
-            token_counter=count_tokens_approximately,
-            model=self.model,
-            max_tokens=max_context_tokens,
-            max_summary_tokens=max_summary_tokens,
-            output_messages_key="llm_input_messages",
-        )
+        # === Summarization Node for rolling memory (optional) ===
+        self.summarization_node = None
+        self.State = None
+        if enable_summarization:
+            from langgraph.prebuilt.chat_agent_executor import AgentState
+            from langmem.short_term import SummarizationNode, RunningSummary
+            from agent.tokens import count_tokens
+
+            self.summarization_node = SummarizationNode(
+                token_counter=count_tokens,
+                model=self.model,
+                max_tokens=max_context_tokens,
+                max_summary_tokens=max_summary_tokens,
+                output_messages_key="llm_input_messages",
+            )
+
+            class State(AgentState):
+                context: dict[str, RunningSummary]
 
-        # === State and checkpointing setup ===
-        class State(AgentState):
-            context: dict[str, RunningSummary]
+            self.State = State
 
-        self.State = State
-        self.checkpointer = InMemorySaver()
+        # === Checkpointing setup ===
+        # Evicts the least recently used conversation beyond max_threads
+        self.checkpointer = BoundedInMemorySaver(max_threads=max_threads)
 
         # === Initialize agent lazily ===
         self.agent = None
+        self._owned_cache_key = None
+        # Graph cache key minus the tool names, which initialize() adds. The
+        # HTTP clients are compared by identity: tools and model call through them.
+        self._graph_config = (
+            model_name,
+            self.openai_api_key,
+            max_retries,
+            http_async_client,
+            self._mcp_http_client,
+            tuple(
+                (name, server.get("url") or server.get("command"), server["transport"])
+                for name, server in sorted(mcp_servers.items())
+            ),
+            (max_context_tokens, max_summary_tokens) if enable_summarization else None,
+        )
+
+    def _mcp_http_client_factory(self, headers=None, timeout=None, auth=None) -> httpx.AsyncClient:
+        """Hands the shared connection pool to each MCP streamable_http session."""
+        # Headers are sent per request, but httpx binds auth to the client, so
+        # an authenticated server gets its own client as it would without the pool
+        if auth is not None:
+            from mcp.shared._httpx_utils import create_mcp_http_client
+
+            return create_mcp_http_client(headers=headers, timeout=timeout, auth=auth)
+        return self._mcp_http_client
 
     async def initialize(self):
         """Initializes the agent asynchronously (loads tools)."""
+        from langgraph.prebuilt import create_react_agent
+
         logger.info("⚙️ Initializing agent and loading tools...")
         tools = []
         if self.client:
             try:
                 tools = await self.client.get_tools()
-                logger.info(f"✅ Loaded {len(tools)} tools from MCP servers")
-                for i, tool in enumerate(tools, 1):
-                    logger.info(f"  {i}. {tool.name}")
+                logger.info("✅ Loaded %d tools from MCP servers", len(tools))
+                if logger.isEnabledFor(logging.DEBUG):
+                    for i, tool in enumerate(tools, 1):
+                        logger.debug("  %d. %s", i, tool.name)
             except Exception as e:
-                logger.error(f"❌ Error loading tools: {e}")
+                logger.error("❌ Error loading tools: %s", e)
                 raise
 
-        self.agent = create_react_agent(
-            model=self.model,
-            tools=tools,
-            # state_schema=self.State,
-            checkpointer=self.checkpointer,
-            # pre_model_hook=self.summarization_node,  # optional: enable if summarization is desired
-        )
+        cache_key = (*self._graph_config, tuple(sorted(tool.name for tool in tools)))
+        graph = self._AGENT_CACHE.get(cache_key)
+        if graph is None:
+            graph = create_react_agent(
+                model=self.model,
+                tools=tools,
+                state_schema=self.State,  # None unless summarization is enabled
+                pre_model_hook=self.summarization_node,
+                prompt=_agent_prompt,
+            )
+            self._AGENT_CACHE[cache_key] = graph
+            self._owned_cache_key = cache_key
+            while len(self._AGENT_CACHE) > self._AGENT_CACHE_SIZE:
+                self._AGENT_CACHE.popitem(last=False)
+        else:
+            self._AGENT_CACHE.move_to_end(cache_key)
+            logger.info("♻️ Reusing compiled agent graph")
+
+        self.agent = graph.copy(update={"checkpointer": self.checkpointer})
         logger.info("✅ Agent initialized successfully")
 
-    async def invoke(self, user_prompt: str, thread_id: str = "1") -> Any:
-        """Invokes the ReAct agent asynchronously."""
+    async def invoke(self, user_prompt: str, thread_id: str = "1", structured: bool = False) -> Any:
+        """Invokes the ReAct agent asynchronously.
+
+        With ``structured=True`` the agent is asked to reply with
+        FinancialAgentOutput JSON (see ``invoke_structured``).
+        """
         logger.info("=" * 80)
-        logger.info(f"💬 USER PROMPT (Thread: {thread_id}):")
-        logger.info(f"   {user_prompt}")
+        logger.info("💬 USER PROMPT (Thread: %s):", thread_id)
+        logger.debug("   %s", user_prompt)
         logger.info("=" * 80)
         
         if not self.agent:
             await self.initialize()
 
-        config = {"configurable": {"thread_id": thread_id}}
+        # "structured" is read by _agent_prompt and doesn't touch the messages
+        config = {"configurable": {"thread_id": thread_id, "structured": structured}}
         
         # Enhanced prompt to force tool usage when charts are mentioned
         enhanced_prompt = user_prompt
@@ -145,87 +321,107 @@ IMPORTANT: You MUST use the charting tool to create visualizations. Do not just
 
         try:
             logger.info("🤖 Invoking agent...")
-            response = await self.agent.ainvoke(
-                {"messages": [{"role":"system","content":system_prompt},{"role": "user", "content": enhanced_prompt}]},
+            response = None
+            logged = 0
+            # Stream state snapshots so each message is handled as soon as the
+            # graph produces it instead of after the whole run has finished
+            async for state in self.agent.astream(
+                {"messages": [SYSTEM_MSG, {"role": "user", "content": enhanced_prompt}]},
                 config=config,
-            )
+                stream_mode="values",
+            ):
+                response = state
+                if logger.isEnabledFor(logging.INFO):
+                    messages = state.get("messages", [])
+                    for i in range(logged, len(messages)):
+                        self._log_message(i, messages[i])
+                    logged = len(messages)
             
             # Log the response
             if response and "messages" in response:
-                logger.info(f"📨 Received {len(response['messages'])} messages")
-                
-                # Log tool calls if any
-                for i, msg in enumerate(response["messages"]):
-                    msg_type = getattr(msg, 'type', 'unknown')
-                    if msg_type == 'ai' and hasattr(msg, 'tool_calls') and msg.tool_calls:
-                        logger.info(f"   🔧 AI Message {i} used {len(msg.tool_calls)} tool(s):")
-                        for tc in msg.tool_calls:
-                            logger.info(f"      - {tc.get('name', 'unknown')} with args: {tc.get('args', {})}")
-                    elif msg_type == 'tool':
-                        logger.info(f"   📊 Tool Message {i}: {getattr(msg, 'name', 'unknown')}")
+                logger.info("📨 Received %d messages", len(response["messages"]))
                 
                 final_message = response["messages"][-1]
-                logger.info(f"✅ AGENT RESPONSE:")
-                logger.info(f"   Role: {getattr(final_message, 'type', 'unknown')}")
-                logger.info(f"   Content: {final_message.content[:500]}..." if len(str(final_message.content)) > 500 else f"   Content: {final_message.content}")
+                logger.info("✅ AGENT RESPONSE:")
+                logger.info("   Role: %s", getattr(final_message, 'type', 'unknown'))
+                logger.debug("   Content: %.500s", final_message.content)
             
             logger.info("=" * 80)
             return response
             
         except Exception as e:
-            logger.error(f"❌ Error during agent invocation: {e}")
+            logger.error("❌ Error during agent invocation: %s", e)
             logger.exception("Full traceback:")
             raise
 
+    @staticmethod
+    def _log_message(i: int, msg: Any) -> None:
+        """Logs the tool activity of a single agent message."""
+        msg_type = getattr(msg, 'type', 'unknown')
+        if msg_type == 'ai' and hasattr(msg, 'tool_calls') and msg.tool_calls:
+            logger.info("   🔧 AI Message %d used %d tool(s):", i, len(msg.tool_calls))
+            for tc in msg.tool_calls:
+                logger.info("      - %s", tc.get('name', 'unknown'))
+                logger.debug("        args: %s", tc.get('args', {}))
+        elif msg_type == 'tool':
+            logger.info("   📊 Tool Message %d: %s", i, getattr(msg, 'name', 'unknown'))
+
     async def invoke_structured(self, user_prompt: str, thread_id: str = "1") -> FinancialAgentOutput:
         """Invokes the agent and returns structured output."""
         logger.info("📋 Requesting structured output...")
         
-        # First get the regular response
-        response = await self.invoke(user_prompt, thread_id)
+        # Ask the agent to answer directly in the structured format
+        response = await self.invoke(user_prompt, thread_id, structured=True)
         
         # Extract the final message content
         final_message = response["messages"][-1].content
-        logger.info("🔄 Parsing response into structured format...")
-        
-        # Use structured output model to parse the response
-        structured_model = self.model.with_structured_output(FinancialAgentOutput)
-        
-        # Create a parsing prompt
-        parsing_prompt = f"""
-        Please extract the following information from this agent response and format it according to the schema:
-        
-        Agent Response: {final_message}
-        
-        Extract:
-        - user_output (mandatory): The main response to the user
-        - insights_summary (optional): Any key insights or analysis 
-        - charting_url (optional): Any chart URLs that were generated
-        """
         
         try:
-            structured_response = await structured_model.ainvoke([{"role": "user", "content": parsing_prompt}])
+            structured_response = _parse_structured_output(final_message)
+            if structured_response is not None:
+                await self._store_plain_reply(thread_id, response["messages"][-1], structured_response)
+            else:
+                # The agent didn't follow the format; fall back to an extraction call
+                logger.info("🔄 Parsing response into structured format...")
+                structured_response = await self._parse_chain.ainvoke({"final_message": final_message})
             logger.info("✅ STRUCTURED OUTPUT:")
-            logger.info(f"   📝 User Output: {structured_response.user_output[:200]}..." if len(structured_response.user_output) > 200 else f"   📝 User Output: {structured_response.user_output}")
+            logger.debug("   📝 User Output: %.200s", structured_response.user_output)
             if structured_response.insights_summary:
-                logger.info(f"   💡 Insights: {structured_response.insights_summary}")
+                logger.debug("   💡 Insights: %s", structured_response.insights_summary)
             if structured_response.charting_url:
-                logger.info(f"   📊 Chart URL: {structured_response.charting_url}")
+                logger.info("   📊 Chart URL: %s", structured_response.charting_url)
             logger.info("=" * 80)
             return structured_response
         except Exception as e:
-            logger.error(f"❌ Error parsing structured output: {e}")
+            logger.error("❌ Error parsing structured output: %s", e)
             raise
 
-    # async def aclose(self):
-    #     """Closes the MCP client gracefully."""
+    async def _store_plain_reply(self, thread_id: str, message: Any, output: FinancialAgentOutput) -> None:
+        """
+        Replaces the JSON reply saved in the thread with its plain-text content,
+        so later turns on the thread see a normal conversation rather than JSON.
+        """
+        text = "\n\n".join(filter(None, (output.user_output, output.insights_summary, output.charting_url)))
+        # add_messages replaces the stored message with the same id
+        await self.agent.aupdate_state(
+            {"configurable": {"thread_id": thread_id}},
+            {"messages": [message.model_copy(update={"content": text})]},
+            as_node="agent",
+        )
+
+    async def aclose(self):
+        """Closes the MCP client's connection pool gracefully, if this agent created it."""
+        if not self._owns_mcp_http_client:
+            return
         logger.info("🔌 Closing MCP client connections...")
-        if self.client:
-            try:
-            #     await self.client.close()
-                logger.info("✅ MCP client closed")
-            except Exception as e:
-                logger.warning(f"⚠️ Error closing MCP client: {e}")
+        # A graph compiled here calls its tools through this agent's pool
+        if self._owned_cache_key is not None:
+            self._AGENT_CACHE.pop(self._owned_cache_key, None)
+        try:
+            await self._mcp_http_client.aclose()
+            logger.info("✅ MCP client closed")
+        except Exception as e:
+            logger.warning("⚠️ Error closing MCP client: %s", e)
 
 
 # === Example Usage ===
@@ -243,6 +439,6 @@ if __name__ == "__main__":
         structured_response = await agent.invoke_structured(test_prompt)
         print("Structured response:", structured_response)
         
-        # await agent.aclose()
+        await agent.aclose()
 
     asyncio.run(main())
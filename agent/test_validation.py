@@ -7,12 +7,17 @@ import asyncio
 import sys
 import os
 
+try:
+    import uvloop
+except ImportError:  # uvloop isn't available on Windows
+    uvloop = None
+
 # Add current directory to path so we can import from agent module
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 
-from agent.test_client import FinancialAgent
+from agent.test_client import FinancialAgent, _parse_structured_output
 from agent.misc import test_prompt
-from response_validator import AgentResponse
+from agent.response_validator import AgentResponse
 
 
 async def test_basic_validation():
@@ -46,6 +51,14 @@ async def test_basic_validation():
     print()
 
 
+async def _run_method(agent, method_name, thread_id):
+    """Run one agent response method on test_prompt, if the agent provides it"""
+    method = getattr(agent, method_name, None)
+    if method is None:
+        raise AttributeError(f"FinancialAgent has no {method_name}() method")
+    return await method(test_prompt, thread_id=thread_id)
+
+
 async def test_agent_with_validation():
     """Test the FinancialAgent with response validation"""
     print("🤖 Testing FinancialAgent with Response Validation")
@@ -60,35 +73,42 @@ async def test_agent_with_validation():
         print(f"📝 Query: {test_prompt[:100]}...")
         print()
         
+        # The three methods make independent LLM round trips, so run them
+        # concurrently, each on its own thread so their checkpoints don't mix;
+        # failures (including a missing method) come back as exceptions
+        chat_response, structured, analysis = await asyncio.gather(
+            _run_method(agent, "chat", "validation-chat"),
+            _run_method(agent, "invoke_structured", "validation-structured"),
+            _run_method(agent, "get_full_analysis", "validation-analysis"),
+            return_exceptions=True,
+        )
+        
         # Method 1: Simple chat (just text)
         print("1️⃣ Simple Chat Response:")
         print("-" * 30)
-        try:
-            chat_response = await agent.chat(test_prompt)
+        if isinstance(chat_response, Exception):
+            print(f"❌ Chat error: {chat_response}")
+        else:
             print(chat_response)
-        except Exception as e:
-            print(f"❌ Chat error: {e}")
         print()
         
         # Method 2: Structured response
         print("2️⃣ Structured Response:")
         print("-" * 30)
-        try:
-            structured = await agent.invoke_structured(test_prompt)
+        if isinstance(structured, Exception):
+            print(f"❌ Structured response error: {structured}")
+        else:
             print("Raw structured object:")
             print(structured.to_json_string())
-        except Exception as e:
-            print(f"❌ Structured response error: {e}")
         print()
         
         # Method 3: Full analysis dictionary
         print("3️⃣ Full Analysis Dictionary:")
         print("-" * 30)
-        try:
-            analysis = await agent.get_full_analysis(test_prompt)
+        if isinstance(analysis, Exception):
+            print(f"❌ Analysis error: {analysis}")
+        else:
             print(analysis)
-        except Exception as e:
-            print(f"❌ Analysis error: {e}")
         
         # Cleanup
         await agent.aclose()
@@ -100,6 +120,31 @@ async def test_agent_with_validation():
         traceback.print_exc()
 
 
+async def test_structured_then_plain():
+    """A structured query must not leave a thread answering in JSON"""
+    print("🧵 Testing a plain query after a structured one on the same thread")
+    print("=" * 60)
+    
+    agent = FinancialAgent(model_name="gpt-4o")
+    try:
+        thread_id = "validation-followup"
+        await agent.invoke_structured("What is Apple's current stock price?", thread_id=thread_id)
+        response = await agent.invoke("And what about Microsoft?", thread_id=thread_id)
+        plain = response["messages"][-1].content
+        print(plain)
+        
+        # The format instruction is never saved to the thread, and the JSON
+        # reply is stored as plain text, so the follow-up answers normally
+        if _parse_structured_output(plain) is None:
+            print("✅ Follow-up answered in plain text")
+        else:
+            print("❌ Follow-up answered in structured JSON")
+    except Exception as e:
+        print(f"❌ Follow-up test failed: {e}")
+    finally:
+        await agent.aclose()
+
+
 async def interactive_test():
     """Interactive test mode"""
     print("🎯 Interactive Financial Agent with Response Validation")
@@ -154,10 +199,11 @@ async def main():
     elif len(sys.argv) > 1 and sys.argv[1] == "--validation-only":
         await test_basic_validation()
     else:
-        # Run both tests
+        # Run all tests
         await test_basic_validation()
         await test_agent_with_validation()
+        await test_structured_then_plain()
 
 
 if __name__ == "__main__":
-    asyncio.run(main())
+    (uvloop.run if uvloop else asyncio.run)(main())
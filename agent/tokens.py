@@ -0,0 +1,36 @@
+"""
+Token counting for the agent's summarization node.
+"""
+import tiktoken
+from langchain_core.messages.utils import count_tokens_approximately
+
+from agent.misc import system_prompt
+
+# Encoding used by the gpt-4o / gpt-5 model families
+_ENCODING = tiktoken.get_encoding("o200k_base")
+
+# Per-message overhead of the chat format (role and separators)
+TOKENS_PER_MESSAGE = 3
+
+# system_prompt is constant, so its count is computed once at import time
+SYSTEM_PROMPT_TOKENS = len(_ENCODING.encode_ordinary(system_prompt)) + TOKENS_PER_MESSAGE
+
+
+def count_tokens(messages) -> int:
+    """
+    Count message tokens with tiktoken's native BPE.
+
+    Messages whose content isn't plain text (tool calls, content blocks)
+    fall back to count_tokens_approximately.
+    """
+    total = 0
+    for message in messages:
+        content = message.content
+        if isinstance(content, str) and not getattr(message, "tool_calls", None):
+            if content == system_prompt:
+                total += SYSTEM_PROMPT_TOKENS
+            else:
+                total += len(_ENCODING.encode_ordinary(content)) + TOKENS_PER_MESSAGE
+        else:
+            total += count_tokens_approximately([message])
+    return total
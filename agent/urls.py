@@ -7,8 +7,9 @@ from . import views
 app_name = 'agent'
 
 urlpatterns = [
-    path('', views.HealthCheckView.as_view(), name='index'),
+    path('', views.health_check, name='index'),
     path('query/', views.AgentQueryView.as_view(), name='query'),
     path('query/structured/', views.AgentStructuredQueryView.as_view(), name='query_structured'),
-    path('health/', views.HealthCheckView.as_view(), name='health'),
+    path('query/batch/', views.AgentBatchQueryView.as_view(), name='query_batch'),
+    path('health/', views.health_check, name='health'),
 ]
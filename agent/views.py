@@ -2,123 +2,219 @@
 Views for the financial agent API.
 """
 import asyncio
+import atexit
 import logging
-from rest_framework.views import APIView
+import math
+import orjson
+from adrf.views import APIView
+from async_lru import alru_cache
 from rest_framework.response import Response
 from rest_framework import status
 from django.conf import settings
+from django.http import HttpResponse
+from django.views.decorators.http import require_safe
+from pydantic import ValidationError
 
+from . import apps
+from .apps import arun_on_agent_loop, run_on_agent_loop
 from .test_client import FinancialAgent
-from .serializers import AgentQuerySerializer, AgentResponseSerializer, StructuredAgentResponseSerializer
+from .serializers import (
+    AgentBatchQuery,
+    AgentQuery,
+    format_validation_errors,
+)
 
 logger = logging.getLogger(__name__)
 
+# Process-wide agent, created on the agent event loop by the first request.
+# DRF instantiates a new view per request, so it can't live on the view.
+_AGENT: FinancialAgent | None = None
+_AGENT_LOCK = asyncio.Lock()
 
-class AgentQueryView(APIView):
+# Caps how many agent runs, from any endpoint, call OpenAI at once on the agent
+# event loop; excess requests queue here instead of piling into rate limits
+_AGENT_SEMAPHORE = asyncio.Semaphore(settings.AGENT_MAX_CONCURRENCY)
+
+# Error reported when an agent run exceeds AGENT_REQUEST_TIMEOUT
+_TIMEOUT_MESSAGE = f"Query timed out after {settings.AGENT_REQUEST_TIMEOUT}s"
+
+# FinancialAgent settings, read from Django settings once at import
+_AGENT_KW = dict(
+    chart_url=settings.CHART_URL,
+    model_name=settings.OPENAI_MODEL,
+    max_context_tokens=settings.MAX_CONTEXT_TOKENS,
+    max_summary_tokens=settings.MAX_SUMMARY_TOKENS,
+    enable_yfinance=settings.ENABLE_YFINANCE,
+    enable_tavily=settings.ENABLE_TAVILY,
+    max_threads=settings.MAX_CHECKPOINT_THREADS,
+    enable_summarization=settings.ENABLE_SUMMARIZATION,
+    max_retries=settings.OPENAI_MAX_RETRIES,
+)
+
+
+async def _get_agent() -> FinancialAgent:
+    """Get or create the shared agent instance."""
+    global _AGENT
+    if _AGENT is None:
+        async with _AGENT_LOCK:
+            if _AGENT is None:
+                agent = FinancialAgent(
+                    **_AGENT_KW,
+                    mcp_http_client=apps.mcp_http_client,
+                    http_async_client=apps.openai_http_client,
+                )
+                await agent.initialize()
+                _AGENT = agent
+    return _AGENT
+
+
+def _json_default(obj):
+    """orjson fallback: public attributes of objects, str() for anything else"""
+    if hasattr(obj, '__dict__'):
+        return {k: v for k, v in vars(obj).items() if not k.startswith('_')}
+    return str(obj)
+
+
+def _make_serializable(obj):
     """
-    API endpoint for querying the financial agent.
+    Encode complex objects (e.g. LangChain messages) to JSON once. The result is
+    an orjson.Fragment, which ORJSONRenderer embeds as-is instead of decoding
+    and re-encoding it.
     """
-    
-    def __init__(self, **kwargs):
-        super().__init__(**kwargs)
-        self._agent = None
-    
-    def _make_serializable(self, obj):
-        """Convert complex objects to JSON-serializable format"""
-        import json
-        
-        if obj is None:
-            return None
-        
-        # Try to convert to dict
-        if hasattr(obj, '__dict__'):
-            try:
-                return {k: self._make_serializable(v) for k, v in obj.__dict__.items() if not k.startswith('_')}
-            except:
-                pass
-        
-        # Handle lists
-        if isinstance(obj, list):
-            return [self._make_serializable(item) for item in obj]
-        
-        # Handle dicts
-        if isinstance(obj, dict):
-            return {k: self._make_serializable(v) for k, v in obj.items()}
-        
-        # Handle primitives
-        if isinstance(obj, (str, int, float, bool, type(None))):
-            return obj
-        
-        # Convert to string as fallback
+    try:
+        return orjson.Fragment(orjson.dumps(
+            obj,
+            default=_json_default,
+            option=orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY,
+        ))
+    except orjson.JSONEncodeError:
+        return None
+
+
+def _response_cache(func):
+    """
+    With AGENT_ENABLE_CACHE, reuse the response of an identical
+    (prompt, thread_id) query for AGENT_CACHE_TTL seconds, so client retries
+    and double submits don't rerun the agent. Failed runs are not cached.
+
+    Off by default: threads are stateful, so a prompt deliberately repeated
+    within the TTL gets the earlier answer and the turn isn't recorded.
+    """
+    if not settings.AGENT_ENABLE_CACHE:
+        return func
+    return alru_cache(maxsize=1024, ttl=settings.AGENT_CACHE_TTL)(func)
+
+
+async def _run_agent(method, user_prompt: str, thread_id: str):
+    """
+    Run one agent call once it holds an _AGENT_SEMAPHORE slot. The
+    AGENT_REQUEST_TIMEOUT clock starts only then, so time spent queueing for
+    a slot under load doesn't count against it.
+    """
+    async with _AGENT_SEMAPHORE:
         try:
-            return str(obj)
-        except:
-            return None
-    
-    async def get_agent(self):
-        """Get or create the agent instance."""
-        if self._agent is None:
-            self._agent = FinancialAgent(
-                chart_url=settings.CHART_URL,
-                model_name=settings.OPENAI_MODEL,
-                max_context_tokens=settings.MAX_CONTEXT_TOKENS,
-                max_summary_tokens=settings.MAX_SUMMARY_TOKENS,
-                enable_yfinance=settings.ENABLE_YFINANCE,
-                enable_tavily=settings.ENABLE_TAVILY,
+            return await asyncio.wait_for(
+                method(user_prompt, thread_id), settings.AGENT_REQUEST_TIMEOUT
             )
-            await self._agent.initialize()
-        return self._agent
+        except TimeoutError:
+            raise TimeoutError(_TIMEOUT_MESSAGE) from None
+
+
+@_response_cache
+async def _invoke(user_prompt: str, thread_id: str):
+    """Run an agent query; executes on the agent event loop."""
+    agent = await _get_agent()
+    return await _run_agent(agent.invoke, user_prompt, thread_id)
+
+
+@_response_cache
+async def _invoke_structured(user_prompt: str, thread_id: str):
+    """Run a structured agent query; executes on the agent event loop."""
+    agent = await _get_agent()
+    return await _run_agent(agent.invoke_structured, user_prompt, thread_id)
+
+
+async def _invoke_batch(queries: list[tuple[str, str]]) -> list:
+    """Run (prompt, thread_id) queries concurrently; executes on the agent event loop."""
+    agent = await _get_agent()
+    # Each prompt gets its own timeout, so a slow prompt becomes an error entry
+    # instead of failing the whole batch
+    tasks = [asyncio.ensure_future(_run_agent(agent.invoke, p, t)) for p, t in queries]
+    # Overall bound: enough rounds of the semaphore for every prompt to get its
+    # full per-query timeout; prompts still running then are cancelled
+    deadline = settings.AGENT_REQUEST_TIMEOUT * math.ceil(len(tasks) / settings.AGENT_MAX_CONCURRENCY)
+    _, pending = await asyncio.wait(tasks, timeout=deadline)
+    for task in pending:
+        task.cancel()
+    await asyncio.gather(*pending, return_exceptions=True)
+
+    # Results keep the input order; failures are returned rather than raised
+    return [
+        TimeoutError(f"Batch deadline of {deadline}s reached") if task in pending
+        else task.exception() or task.result()
+        for task in tasks
+    ]
+
+
+@atexit.register
+def _close_agent():
+    """Close the shared agent's connections once at interpreter exit."""
+    global _AGENT
+    agent, _AGENT = _AGENT, None
+    if agent is not None:
+        try:
+            run_on_agent_loop(agent.aclose(), timeout=5)
+        except Exception as e:
+            logger.warning("⚠️ Error closing agent: %s", e)
+
+
+class AgentQueryView(APIView):
+    """
+    API endpoint for querying the financial agent.
+    """
     
-    def post(self, request):
+    async def post(self, request):
         """Handle POST request to query the agent."""
-        logger.info(f"📥 Received query request from {request.META.get('REMOTE_ADDR', 'unknown')}")
+        logger.info("📥 Received query request from %s", request.META.get('REMOTE_ADDR', 'unknown'))
         
-        serializer = AgentQuerySerializer(data=request.data)
-        
-        if not serializer.is_valid():
-            logger.warning(f"❌ Invalid request data: {serializer.errors}")
-            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
-        
-        user_prompt = serializer.validated_data['prompt']
-        thread_id = serializer.validated_data.get('thread_id', '1')
+        try:
+            query = AgentQuery.model_validate_json(request.body)
+        except ValidationError as e:
+            errors = format_validation_errors(e)
+            logger.warning("❌ Invalid request data: %s", errors)
+            return Response(errors, status=status.HTTP_400_BAD_REQUEST)
         
-        logger.info(f"🎯 Processing query for thread {thread_id}")
+        user_prompt = query.prompt
+        thread_id = query.thread_id
         
-        # Run async code in sync context
-        async def run_query():
-            agent = await self.get_agent()
-            response = await agent.invoke(user_prompt, thread_id)
-            return response
+        logger.info("🎯 Processing query for thread %s", thread_id)
         
         try:
-            response = asyncio.run(run_query())
+            # AGENT_REQUEST_TIMEOUT applies inside _invoke, once a slot is free
+            response = await arun_on_agent_loop(_invoke(user_prompt, thread_id))
             
             # Extract the final message
             final_message = response["messages"][-1].content if response.get("messages") else ""
             
-            # Convert response to serializable format
-            serializable_response = self._make_serializable(response)
-            
             response_data = {
                 'response': final_message,
                 'thread_id': thread_id,
-                'full_response': serializable_response
             }
             
-            response_serializer = AgentResponseSerializer(data=response_data)
-            if response_serializer.is_valid():
-                logger.info("✅ Query completed successfully")
-                return Response(response_serializer.data, status=status.HTTP_200_OK)
-            else:
-                logger.error(f"❌ Response serialization error: {response_serializer.errors}")
-                # Return response anyway without full_response
-                return Response({
-                    'response': final_message,
-                    'thread_id': thread_id
-                }, status=status.HTTP_200_OK)
+            # The full agent trace is large and only needed for debugging
+            if request.query_params.get('debug'):
+                response_data['full_response'] = _make_serializable(response)
+            
+            # The payload is built here from trusted data; no need to re-validate it
+            logger.info("✅ Query completed successfully")
+            return Response(response_data, status=status.HTTP_200_OK)
+        
+        except TimeoutError:
+            logger.warning("⏱️ Query for thread %s timed out", thread_id)
+            return Response({'error': _TIMEOUT_MESSAGE}, status=status.HTTP_504_GATEWAY_TIMEOUT)
                 
         except Exception as e:
-            logger.error(f"❌ Error processing query: {e}")
+            logger.error("❌ Error processing query: %s", e)
             logger.exception("Full traceback:")
             return Response(
                 {'error': str(e)},
@@ -131,65 +227,39 @@ class AgentStructuredQueryView(APIView):
     API endpoint for querying the financial agent with structured output.
     """
     
-    def __init__(self, **kwargs):
-        super().__init__(**kwargs)
-        self._agent = None
-    
-    async def get_agent(self):
-        """Get or create the agent instance."""
-        if self._agent is None:
-            self._agent = FinancialAgent(
-                chart_url=settings.CHART_URL,
-                model_name=settings.OPENAI_MODEL,
-                max_context_tokens=settings.MAX_CONTEXT_TOKENS,
-                max_summary_tokens=settings.MAX_SUMMARY_TOKENS,
-                enable_yfinance=settings.ENABLE_YFINANCE,
-                enable_tavily=settings.ENABLE_TAVILY,
-            )
-            await self._agent.initialize()
-        return self._agent
-    
-    def post(self, request):
+    async def post(self, request):
         """Handle POST request to query the agent with structured output."""
-        logger.info(f"📥 Received structured query request from {request.META.get('REMOTE_ADDR', 'unknown')}")
-        
-        serializer = AgentQuerySerializer(data=request.data)
+        logger.info("📥 Received structured query request from %s", request.META.get('REMOTE_ADDR', 'unknown'))
         
-        if not serializer.is_valid():
-            logger.warning(f"❌ Invalid request data: {serializer.errors}")
-            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
-        
-        user_prompt = serializer.validated_data['prompt']
-        thread_id = serializer.validated_data.get('thread_id', '1')
+        try:
+            query = AgentQuery.model_validate_json(request.body)
+        except ValidationError as e:
+            errors = format_validation_errors(e)
+            logger.warning("❌ Invalid request data: %s", errors)
+            return Response(errors, status=status.HTTP_400_BAD_REQUEST)
         
-        logger.info(f"🎯 Processing structured query for thread {thread_id}")
+        user_prompt = query.prompt
+        thread_id = query.thread_id
         
-        # Run async code in sync context
-        async def run_query():
-            agent = await self.get_agent()
-            response = await agent.invoke_structured(user_prompt, thread_id)
-            return response
+        logger.info("🎯 Processing structured query for thread %s", thread_id)
         
         try:
-            structured_response = asyncio.run(run_query())
+            # AGENT_REQUEST_TIMEOUT applies inside _invoke_structured, once a slot is free
+            structured_response = await arun_on_agent_loop(_invoke_structured(user_prompt, thread_id))
             
-            response_data = {
-                'user_output': structured_response.user_output,
-                'insights_summary': structured_response.insights_summary,
-                'charting_url': structured_response.charting_url,
-                'thread_id': thread_id,
-            }
+            # Already an AgentResponse, so it is dumped as-is rather than re-validated.
+            # model_dump returns a fresh dict, leaving a cached response untouched.
+            payload = structured_response.model_dump()
+            payload['thread_id'] = thread_id
+            logger.info("✅ Structured query completed successfully")
+            return Response(payload, status=status.HTTP_200_OK)
+        
+        except TimeoutError:
+            logger.warning("⏱️ Structured query for thread %s timed out", thread_id)
+            return Response({'error': _TIMEOUT_MESSAGE}, status=status.HTTP_504_GATEWAY_TIMEOUT)
             
-            response_serializer = StructuredAgentResponseSerializer(data=response_data)
-            if response_serializer.is_valid():
-                logger.info("✅ Structured query completed successfully")
-                return Response(response_serializer.data, status=status.HTTP_200_OK)
-            else:
-                logger.error(f"❌ Response serialization error: {response_serializer.errors}")
-                return Response(response_serializer.errors, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
-                
         except Exception as e:
-            logger.error(f"❌ Error processing structured query: {e}")
+            logger.error("❌ Error processing structured query: %s", e)
             logger.exception("Full traceback:")
             return Response(
                 {'error': str(e)},
@@ -197,11 +267,57 @@ class AgentStructuredQueryView(APIView):
             )
 
 
-class HealthCheckView(APIView):
+class AgentBatchQueryView(APIView):
     """
-    Simple health check endpoint.
+    API endpoint for running several prompts through the financial agent at once.
     """
     
-    def get(self, request):
-        """Handle GET request for health check."""
-        return Response({'status': 'healthy'}, status=status.HTTP_200_OK)
+    async def post(self, request):
+        """Handle POST request to query the agent with a batch of prompts."""
+        logger.info("📥 Received batch query request from %s", request.META.get('REMOTE_ADDR', 'unknown'))
+        
+        try:
+            query = AgentBatchQuery.model_validate_json(request.body)
+        except ValidationError as e:
+            errors = format_validation_errors(e)
+            logger.warning("❌ Invalid request data: %s", errors)
+            return Response(errors, status=status.HTTP_400_BAD_REQUEST)
+        
+        # Each prompt gets its own thread so concurrent runs don't interleave
+        queries = [(prompt, f"{query.thread_id}-{i}") for i, prompt in enumerate(query.prompts, 1)]
+        
+        logger.info("🎯 Processing %d batched queries for thread %s", len(queries), query.thread_id)
+        
+        try:
+            # Timeouts apply per prompt inside _invoke_batch
+            responses = await arun_on_agent_loop(_invoke_batch(queries))
+        except Exception as e:
+            logger.error("❌ Error processing batch query: %s", e)
+            logger.exception("Full traceback:")
+            return Response(
+                {'error': str(e)},
+                status=status.HTTP_500_INTERNAL_SERVER_ERROR
+            )
+        
+        results = []
+        for (_, thread_id), response in zip(queries, responses):
+            if isinstance(response, BaseException):
+                logger.error("❌ Error processing batched query for thread %s: %s", thread_id, response)
+                results.append({'error': str(response), 'thread_id': thread_id})
+            else:
+                final_message = response["messages"][-1].content if response.get("messages") else ""
+                results.append({'response': final_message, 'thread_id': thread_id})
+        
+        logger.info("✅ Batch query completed")
+        return Response({'results': results}, status=status.HTTP_200_OK)
+
+
+# Load balancer probes hit this constantly, so it skips DRF entirely and
+# returns a prebuilt body
+_HEALTHY_BODY = b'{"status":"healthy"}'
+
+
+@require_safe
+def health_check(request):
+    """Simple health check endpoint."""
+    return HttpResponse(_HEALTHY_BODY, content_type='application/json')
@@ -28,6 +28,7 @@ INSTALLED_APPS = [
     'django.contrib.messages',
     'django.contrib.staticfiles',
     'rest_framework',
+    'adrf',
     'corsheaders',
     'agent',
 ]
@@ -124,7 +125,7 @@ CORS_ALLOWED_ORIGINS = os.getenv('CORS_ALLOWED_ORIGINS', 'http://localhost:3000,
 # REST Framework settings
 REST_FRAMEWORK = {
     'DEFAULT_RENDERER_CLASSES': [
-        'rest_framework.renderers.JSONRenderer',
+        'agent.renderers.ORJSONRenderer',
     ],
     'DEFAULT_PARSER_CLASSES': [
         'rest_framework.parsers.JSONParser',
@@ -134,7 +135,14 @@ REST_FRAMEWORK = {
 # Agent settings
 CHART_URL = os.getenv('CHART_URL', 'http://localhost:1122/mcp')
 OPENAI_MODEL = os.getenv('OPENAI_MODEL', 'gpt-5')  # Use gpt-5 for higher capability
+OPENAI_MAX_RETRIES = int(os.getenv('OPENAI_MAX_RETRIES', '5'))  # Backoff retries on rate limits
 MAX_CONTEXT_TOKENS = int(os.getenv('MAX_CONTEXT_TOKENS', '2000'))
 MAX_SUMMARY_TOKENS = int(os.getenv('MAX_SUMMARY_TOKENS', '1000'))
+MAX_CHECKPOINT_THREADS = int(os.getenv('MAX_CHECKPOINT_THREADS', '1024'))  # Conversations kept in memory
 ENABLE_YFINANCE = os.getenv('ENABLE_YFINANCE', 'False').lower() == 'true'
 ENABLE_TAVILY = os.getenv('ENABLE_TAVILY', 'False').lower() == 'true'
+ENABLE_SUMMARIZATION = os.getenv('ENABLE_SUMMARIZATION', 'False').lower() == 'true'  # Uses MAX_*_TOKENS
+AGENT_REQUEST_TIMEOUT = int(os.getenv('AGENT_REQUEST_TIMEOUT', '300'))  # Seconds per agent run, counted once it has a concurrency slot
+AGENT_MAX_CONCURRENCY = int(os.getenv('AGENT_MAX_CONCURRENCY', '16'))  # Concurrent agent runs per process
+AGENT_ENABLE_CACHE = os.getenv('AGENT_ENABLE_CACHE', 'False').lower() == 'true'  # Uses AGENT_CACHE_TTL
+AGENT_CACHE_TTL = int(os.getenv('AGENT_CACHE_TTL', '60'))  # Seconds a repeated (prompt, thread_id) reuses its response
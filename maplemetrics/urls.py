@@ -3,21 +3,26 @@ URL configuration for maplemetrics project.
 """
 from django.contrib import admin
 from django.urls import path, include
-from django.http import JsonResponse
+from django.http import HttpResponse
 from django.views.generic import TemplateView
+import orjson
+
+# The endpoint listing is static, so it is encoded once at import
+_API_ROOT_BYTES = orjson.dumps({
+    'message': 'MapleMetrics Financial Agent API',
+    'version': '1.0',
+    'endpoints': {
+        'health': '/api/agent/health/',
+        'query': '/api/agent/query/',
+        'structured_query': '/api/agent/query/structured/',
+        'batch_query': '/api/agent/query/batch/',
+        'admin': '/admin/',
+    }
+})
 
 def api_root(request):
     """Root API endpoint with available endpoints."""
-    return JsonResponse({
-        'message': 'MapleMetrics Financial Agent API',
-        'version': '1.0',
-        'endpoints': {
-            'health': '/api/agent/health/',
-            'query': '/api/agent/query/',
-            'structured_query': '/api/agent/query/structured/',
-            'admin': '/admin/',
-        }
-    })
+    return HttpResponse(_API_ROOT_BYTES, content_type='application/json')
 
 urlpatterns = [
     path('', TemplateView.as_view(template_name='index.html'), name='home'),